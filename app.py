@@ -6,8 +6,16 @@ st.set_page_config(page_title="Legal Document Search", layout="wide")
 st.title("⚖️ Indian Legal Document Search System")
 st.markdown("Compare 4 similarity methods for legal document retrieval using LangChain.")
 
-# Initialize RAG pipeline
-pipeline = RAGPipeline()
+# Initialize RAG pipeline once and reuse it across Streamlit reruns
+@st.cache_resource
+def get_pipeline() -> RAGPipeline:
+    return RAGPipeline()
+
+pipeline = get_pipeline()
+
+def truncate_text(text: str, max_length: int = 300) -> str:
+    # Only chunks longer than the preview get sliced and an ellipsis
+    return text if len(text) <= max_length else f"{text[:max_length]}..."
 
 # Upload documents
 st.sidebar.header("📤 Upload Legal Files")
@@ -18,13 +26,22 @@ if uploaded_files:
     os.makedirs("uploaded", exist_ok=True)
     for file in uploaded_files:
         path = os.path.join("uploaded", file.name)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(file.read().decode())
+        # getvalue() returns the in-memory upload buffer regardless of its read position
+        data = file.getvalue()
+        data.decode("utf-8")  # reject non-UTF-8 uploads before they reach the index
+        # Streamlit re-sends uploads on every rerun; rewriting identical content would
+        # bump the file's mtime and force the indexer to re-hash it
+        if os.path.exists(path) and os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    continue
+        with open(path, "wb") as f:
+            f.write(data)
     st.sidebar.success("Files uploaded!")
 
 # Load and embed documents
+# Only new, changed or deleted files are re-processed; unchanged files keep their index entries
 if st.sidebar.button("🚀 Load & Index Documents"):
-    pipeline.reset()
     pipeline.load_documents()
     st.success("Documents loaded and indexed!")
 
@@ -35,31 +52,32 @@ run_search = st.button("Search")
 if query and run_search:
     st.markdown(f"## 🔍 Query: `{query}`")
     
-    results_cosine = pipeline.query_cosine(query)
-    results_euclidean = [doc for doc, _ in pipeline.query_euclidean(query)]
-    results_mmr = pipeline.query_mmr(query)
-    results_hybrid = [doc for doc, _ in pipeline.query_hybrid(query)]
+    results = pipeline.query_all(query)
+    results_cosine = results["cosine"]
+    results_euclidean = [doc for doc, _ in results["euclidean"]]
+    results_mmr = results["mmr"]
+    results_hybrid = [doc for doc, _ in results["hybrid"]]
 
     col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.markdown("### 🧠 Cosine Similarity")
         for doc in results_cosine:
-            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {doc.page_content[:300]}...")
+            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {truncate_text(doc.page_content)}")
 
     with col2:
         st.markdown("### 📐 Euclidean Distance")
         for doc in results_euclidean:
-            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {doc.page_content[:300]}...")
+            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {truncate_text(doc.page_content)}")
 
     with col3:
         st.markdown("### 🌀 MMR (Diverse)")
         for doc in results_mmr:
-            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {doc.page_content[:300]}...")
+            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {truncate_text(doc.page_content)}")
 
     with col4:
         st.markdown("### ⚖️ Hybrid Similarity")
         for doc in results_hybrid:
-            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {doc.page_content[:300]}...")
+            st.markdown(f"✅ `{doc.metadata['source']}`\n\n> {truncate_text(doc.page_content)}")
 
     st.markdown("---")
     st.markdown("## 📊 Evaluation Metrics")
@@ -77,7 +95,7 @@ if query and run_search:
         ground_truth = []
 
     if ground_truth:
-        metrics = pipeline.evaluate(query, ground_truth)
+        metrics = pipeline.evaluate(query, ground_truth, results=results)
         st.dataframe(metrics)
     else:
         st.warning("Couldn't auto-detect ground truth. Manual labels needed for metric evaluation.")
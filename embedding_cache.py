@@ -0,0 +1,87 @@
+import hashlib
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Stay well below SQLite's default limit on bound parameters per statement
+_MAX_KEYS_PER_QUERY = 500
+
+
+def normalize_query(query: str) -> str:
+    # Whitespace-only variants of a query tokenize identically; used for every query cache key
+    return " ".join(query.split())
+
+
+class EmbeddingCache:
+    """On-disk SQLite store mapping sha256(model name, content) -> embedding vector."""
+
+    def __init__(self, path: str = "embedding_cache.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        # Streamlit serves reruns from different threads, so share one guarded connection
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS emb (key BLOB PRIMARY KEY, vec BLOB)")
+
+    @staticmethod
+    def make_key(model_name: str, content: str) -> bytes:
+        return hashlib.sha256((model_name + "\0" + content).encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        return self.get_many([key])[0]
+
+    def put(self, key: bytes, vec) -> None:
+        self.put_many([(key, vec)])
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            for start in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+                batch = keys[start:start + _MAX_KEYS_PER_QUERY]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM emb WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vec in rows:
+                    found[key] = np.frombuffer(vec, dtype=np.float32)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, items: Sequence[Tuple[bytes, object]]) -> None:
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in items]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO emb (key, vec) VALUES (?, ?)", rows)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts missing from the disk cache to the model."""
+
+    def __init__(self, model: Embeddings, model_name: str, cache: EmbeddingCache, query_cache_size: int = 512):
+        self.model = model
+        self.model_name = model_name
+        self.cache = cache
+        # Repeated queries (re-clicks, evaluation) skip the model forward pass
+        self._embed_query_cached = lru_cache(maxsize=query_cache_size)(self._encode_query)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # Encode each distinct uncached text once, in a single batch
+        misses = {key: text for key, text, vec in zip(keys, texts, vectors) if vec is None}
+        if misses:
+            encoded = self.model.embed_documents(list(misses.values()))
+            new_vectors = dict(zip(misses.keys(), (np.asarray(v, dtype=np.float32) for v in encoded)))
+            self.cache.put_many(list(new_vectors.items()))
+            vectors = [new_vectors[key] if vec is None else vec for key, vec in zip(keys, vectors)]
+
+        return [vec.tolist() for vec in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        return list(self._embed_query_cached(normalize_query(text)))
+
+    def _encode_query(self, text: str) -> Tuple[float, ...]:
+        return tuple(self.model.embed_query(text))
@@ -1,120 +1,459 @@
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import List, Tuple, Dict
+from typing import List, NamedTuple, Optional, Tuple, Dict
+import hashlib
+import inspect
+import json
 import os
-from collections import defaultdict
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from pathlib import Path
 import numpy as np 
+from embedding_cache import EmbeddingCache, CachedEmbeddings, normalize_query
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+LEGAL_KEYWORDS = frozenset(["section", "act", "court", "gst", "income", "registration"])
+# One alternation finds every keyword in a single pass over the text; matching
+# case-insensitively avoids building a lowercased copy of each chunk
+_LEGAL_KEYWORD_RE = re.compile("|".join(map(re.escape, sorted(LEGAL_KEYWORDS))), re.IGNORECASE | re.ASCII)
+
+
+def _detect_device() -> str:
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+@lru_cache(maxsize=None)
+def _load_embedding_model(model_name: str) -> Embeddings:
+    # Loading the model is slow and memory heavy, so share one instance per process.
+    # Unit-norm embeddings make cosine similarity a plain dot product downstream.
+    # Imported here because sentence-transformers pulls in torch at import time.
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": _detect_device()},
+        encode_kwargs={"batch_size": 64, "normalize_embeddings": True},
+    )
+
+
+@lru_cache(maxsize=4096)
+def _legal_keyword_score(content: str) -> int:
+    # Number of distinct legal keywords in a chunk; the same chunks come back across queries
+    return len({match.lower() for match in _LEGAL_KEYWORD_RE.findall(content)})
+
+
+def _cache_results(method):
+    # Memoize a query_* method on (normalized query, arguments) until the index changes
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    def wrapper(self, query: str, *args, **kwargs):
+        # Bind with defaults so query(q), query(q, 5) and query(q, k=5) share one entry
+        bound = signature.bind(self, query, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__, normalize_query(query), tuple(bound.arguments.items())[2:])
+        with self._results_lock:
+            if key in self._results_cache:
+                self._results_cache.move_to_end(key)
+                return list(self._results_cache[key])
+            generation = self._cache_generation
+        results = method(self, query, *args, **kwargs)
+        with self._results_lock:
+            # The index changed while this ran, so the result may come from the old index
+            if self._cache_generation != generation:
+                return list(results)
+            self._results_cache[key] = results
+            if len(self._results_cache) > self.results_cache_size:
+                self._results_cache.popitem(last=False)
+        return list(results)
+    return wrapper
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # O(N) partial selection, then sort just the k winners in descending order
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _maximal_marginal_relevance(query_emb: np.ndarray, candidates: np.ndarray, k: int,
+                                lambda_mult: float = 0.5) -> np.ndarray:
+    # Expects unit-norm rows and query, so every similarity is a plain dot product
+    k = min(k, len(candidates))
+    relevance = candidates @ query_emb
+    max_sim = np.full(len(candidates), -np.inf, dtype=relevance.dtype)
+    active = np.ones(len(candidates), dtype=bool)
+    selected = np.empty(k, dtype=np.intp)
+    mmr_scores = relevance.copy()
+    for i in range(k):
+        mmr_scores[~active] = -np.inf
+        best = int(np.argmax(mmr_scores))
+        selected[i] = best
+        active[best] = False
+        if i + 1 < k:
+            # Fold only the newest pick into the redundancy term instead of recomputing it
+            np.maximum(max_sim, candidates @ candidates[best], out=max_sim)
+            mmr_scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+    return selected
+
+
+class _SearchMatrix(NamedTuple):
+    # Immutable view of the indexed embeddings; queries keep using the snapshot they
+    # started with even if another session re-indexes meanwhile
+    matrix: np.ndarray
+    sq_norms: np.ndarray
+    scales: Optional[np.ndarray]
+    documents: List[str]
+    metadatas: List[dict]
+
+    def dot_all(self, query_emb: np.ndarray) -> np.ndarray:
+        # Dot product of the query with every row; int8 rows accumulate in int32
+        if self.scales is None:
+            return self.matrix @ query_emb
+        query_scale = max(float(np.abs(query_emb).max()), 1e-12) / 127
+        query_int8 = np.round(query_emb / query_scale).astype(np.int8)
+        dots = np.einsum("ij,j->i", self.matrix, query_int8, dtype=np.int32)
+        return dots * (self.scales * query_scale)
+
+    def rows(self, idx: np.ndarray) -> np.ndarray:
+        rows = self.matrix[idx].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[idx, None]
+        return rows
+
+    def document(self, i: int) -> Document:
+        return Document(page_content=self.documents[i], metadata=self.metadatas[i] or {})
+
 
 class RAGPipeline:
-    def __init__(self, data_dir="uploaded", persist_dir="chroma_index"):
+    def __init__(self, data_dir="uploaded", persist_dir="chroma_index", model_name=EMBEDDING_MODEL_NAME,
+                 cache_path="embedding_cache.sqlite", quantize_embeddings=False, chunk_size=500, chunk_overlap=50,
+                 results_cache_size=512):
         self.data_dir = data_dir
         self.persist_dir = persist_dir
-        self.embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        self.documents = []
-
-    def load_documents(self):
-        print("🔹 Loading documents...")
-        for filename in os.listdir(self.data_dir):
-            if filename.endswith(".txt"):
-                with open(os.path.join(self.data_dir, filename), "r", encoding="utf-8") as f:
-                    text = f.read()
-                    chunks = self.split_text_into_chunks(text)
-                    for chunk in chunks:
-                        self.documents.append(Document(page_content=chunk.strip(), metadata={"source": filename}))
-        print(f"✅ Loaded {len(self.documents)} documents")
-        self.build_vectorstore()
-
-    def split_text_into_chunks(self, text: str, chunk_size=500, chunk_overlap=50):
-        splitter = RecursiveCharacterTextSplitter(
+        self.model_name = model_name
+        # Anything that changes the stored chunks or vectors; part of every file hash and the manifest
+        self.index_settings = {"model_name": model_name, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+        # Each settings combination gets its own collection, so a settings change never drops
+        # the collection behind a handle that concurrent queries may still be using
+        settings_hash = hashlib.sha256(json.dumps(self.index_settings, sort_keys=True).encode("utf-8"))
+        self.collection_name = "legal_docs_" + settings_hash.hexdigest()[:16]
+        # Keep the in-memory search matrix as int8 (4x smaller) instead of float32
+        self.quantize_embeddings = quantize_embeddings
+        # Chunks whose content was embedded before are served from disk instead of the model
+        self.embedding_model = CachedEmbeddings(
+            _load_embedding_model(model_name), model_name, EmbeddingCache(cache_path)
+        )
+        # The splitter holds no per-document state, so one instance serves every file
+        self._splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             separators=["\n\n", "\n", ".", " ", ""]
         )
-        return splitter.split_text(text)
+        self.documents = []
+        self.vectorstore = None
+        # Per-method results for repeated queries; cleared whenever the index changes
+        self.results_cache_size = results_cache_size
+        self._results_cache = OrderedDict()
+        self._results_lock = threading.Lock()
+        # Bumped on every index change so in-flight reads of the old index aren't cached
+        self._cache_generation = 0
+        # The pipeline is shared across Streamlit sessions; concurrent loads would both see a
+        # new file as unindexed and add its chunks twice
+        self._index_lock = threading.RLock()
+        self._invalidate_caches()
 
-    def build_vectorstore(self):
-        print("🔹 Building Chroma vector store...")
-        self.vectorstore = Chroma.from_documents(self.documents, self.embedding_model, persist_directory=self.persist_dir)
-        self.vectorstore.persist()
-        print("✅ Vector store built and persisted")
+    def load_documents(self):
+        with self._index_lock:
+            self._load_documents()
 
-    def query_cosine(self, query: str, k: int = 5) -> List[Document]:
-        vectorstore = Chroma(persist_directory=self.persist_dir, embedding_function=self.embedding_model)
-        return vectorstore.similarity_search(query, k=k)
-   
+    def _load_documents(self):
+        print("🔹 Loading documents...")
+        manifest = self._load_manifest()
+        # A manifest written under other model or chunking settings says nothing about this index
+        settings_changed = (manifest.get("settings"), manifest.get("collection")) != (self.index_settings, self.collection_name)
+        files_manifest = {} if settings_changed else manifest.get("files", {})
+        with os.scandir(self.data_dir) as it:
+            entries = [entry for entry in it if entry.name.endswith(".txt") and entry.is_file()]
+        # Largest files first; stat() results are cached on the DirEntry from the scan
+        entries.sort(key=lambda entry: entry.stat().st_size, reverse=True)
+        stats = {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries}
 
-    def query_euclidean(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
-        vectorstore = Chroma(persist_directory=self.persist_dir, embedding_function=self.embedding_model)
+        # Same files with the same size and mtime as the last successful index: nothing to do
+        if files_manifest and stats == {name: (meta["size"], meta["mtime_ns"]) for name, meta in files_manifest.items()}:
+            self.documents = []
+            print("✅ Index is up to date")
+            return
 
-        # Embed query
-        query_emb = self.embedding_model.embed_query(query)
+        indexed = self._indexed_file_hashes()
+        current = {}
+        new_manifest = {}
+        self.documents = []
+        for entry in entries:
+            filename = entry.name
+            size, mtime_ns = stats[filename]
+            previous = files_manifest.get(filename)
+            text = None
+            if previous and (previous["size"], previous["mtime_ns"]) == (size, mtime_ns):
+                # Untouched since the last index, so the recorded hash is still valid
+                file_hash = previous["sha256"]
+            else:
+                text = Path(entry.path).read_text(encoding="utf-8")
+                file_hash = self._file_hash(text)
+            current[filename] = file_hash
+            new_manifest[filename] = {"size": size, "mtime_ns": mtime_ns, "sha256": file_hash}
+            # Unchanged files are already in the index
+            if indexed.get(filename) == file_hash:
+                continue
+            if text is None:
+                text = Path(entry.path).read_text(encoding="utf-8")
+            chunks = self.split_text_into_chunks(text)
+            for chunk in chunks:
+                self.documents.append(Document(
+                    page_content=chunk.strip(),
+                    metadata={"source": filename, "file_hash": file_hash},
+                ))
+
+        # Changed and deleted files have their old chunks dropped before re-adding
+        stale_sources = [name for name, file_hash in indexed.items() if current.get(name) != file_hash]
+        unchanged = sum(1 for name, file_hash in current.items() if indexed.get(name) == file_hash)
+        print(f"✅ Loaded {len(self.documents)} documents ({unchanged} unchanged files skipped)")
+        self.build_vectorstore(stale_sources, drop_other_collections=settings_changed)
+        self._save_manifest({"settings": self.index_settings, "collection": self.collection_name, "files": new_manifest})
+
+    def _file_hash(self, text: str) -> str:
+        settings = json.dumps(self.index_settings, sort_keys=True)
+        return hashlib.sha256((settings + "\0" + text).encode("utf-8")).hexdigest()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.persist_dir, "manifest.json")
+
+    def _load_manifest(self) -> Dict[str, object]:
+        try:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, manifest: Dict[str, object]):
+        os.makedirs(self.persist_dir, exist_ok=True)
+        with open(self._manifest_path(), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+    def split_text_into_chunks(self, text: str) -> List[str]:
+        return self._splitter.split_text(text)
+
+    def _get_store(self) -> Chroma:
+        # Open the persisted collection once and reuse the handle for every query
+        if self.vectorstore is None:
+            self.vectorstore = Chroma(
+                collection_name=self.collection_name,
+                persist_directory=self.persist_dir,
+                embedding_function=self.embedding_model,
+            )
+        return self.vectorstore
+
+    def _indexed_file_hashes(self) -> Dict[str, str]:
+        if not os.path.exists(self.persist_dir):
+            return {}
+        metadatas = self._get_store()._collection.get(include=["metadatas"]).get("metadatas") or []
+        return {meta["source"]: meta.get("file_hash") for meta in metadatas if meta and "source" in meta}
+
+    def build_vectorstore(self, stale_sources=(), drop_other_collections=False):
+        with self._index_lock:
+            print("🔹 Updating Chroma vector store...")
+            vectorstore = self._get_store()
+            for source in stale_sources:
+                vectorstore._collection.delete(where={"source": source})
+            # One upsert must stay within the Chroma client's batch limit, so add in slices
+            batch_size = self._max_batch_size(vectorstore)
+            for start in range(0, len(self.documents), batch_size):
+                vectorstore.add_documents(self.documents[start:start + batch_size])
+            vectorstore.persist()
+            self._invalidate_caches()
+            if drop_other_collections:
+                # Left behind by earlier model or chunking settings; no query reads them
+                self._drop_other_collections(vectorstore)
+            print("✅ Vector store updated and persisted")
+
+    def _drop_other_collections(self, vectorstore: Chroma):
+        client = vectorstore._client
+        for collection in client.list_collections():
+            # Newer chromadb clients list names, older ones Collection objects
+            name = getattr(collection, "name", collection)
+            if name != self.collection_name:
+                client.delete_collection(name)
+
+    @staticmethod
+    def _max_batch_size(vectorstore: Chroma) -> int:
+        client = vectorstore._client
+        if hasattr(client, "get_max_batch_size"):
+            return client.get_max_batch_size()
+        # Older chromadb clients expose the limit as a property
+        return getattr(client, "max_batch_size", None) or 5000
+
+    def _invalidate_caches(self):
+        with self._results_lock:
+            self._cache_generation += 1
+            self._results_cache.clear()
+            self._search_matrix = None
+
+    def _ensure_matrix(self) -> _SearchMatrix:
+        # Pull all stored embeddings once into a contiguous matrix (float32, or int8 when
+        # quantize_embeddings is set); rebuilt after re-indexing
+        snapshot = self._search_matrix
+        if snapshot is not None:
+            return snapshot
+
+        generation = self._cache_generation
+        data = self._get_store()._collection.get(include=["documents", "metadatas", "embeddings"])
 
-        # Get all doc embeddings
-        data = vectorstore._collection.get(include=["documents", "metadatas", "embeddings"])
-        
         embeddings = data.get("embeddings")
         documents = data.get("documents")
         metadatas = data.get("metadatas")
 
         if embeddings is None or documents is None or metadatas is None:
             raise ValueError("No embeddings, documents, or metadatas found in vectorstore")
-        
-        doc_scores = []
-        for doc_emb, content, meta in zip(embeddings, documents, metadatas):
-            distance = np.linalg.norm(np.array(query_emb) - np.array(doc_emb))
-            score = vectorstore._euclidean_relevance_score_fn(distance.__float__())
-            doc = Document(page_content=content, metadata=meta or {})
-            doc_scores.append((doc, score))
 
-        # Sort by score descending (higher = more relevant)
-        doc_scores.sort(key=lambda x: x[1], reverse=True)
-        return doc_scores[:k]
+        emb_matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if emb_matrix.size == 0:
+            emb_matrix = emb_matrix.reshape(0, 0)
+        # Squared row norms are static, so euclidean distances only need one GEMV per query
+        sq_norms = np.einsum("ij,ij->i", emb_matrix, emb_matrix)
+        scales = None
+        if self.quantize_embeddings:
+            # Symmetric per-row int8 quantization
+            scales = np.maximum(np.abs(emb_matrix).max(axis=1, initial=0.0), 1e-12) / 127
+            emb_matrix = np.round(emb_matrix / scales[:, None]).astype(np.int8)
+        snapshot = _SearchMatrix(emb_matrix, sq_norms, scales, documents, metadatas)
+
+        with self._results_lock:
+            # Don't publish a matrix read from an index that changed while we were reading it
+            if self._cache_generation == generation:
+                self._search_matrix = snapshot
+        return snapshot
+
+    @_cache_results
+    def query_cosine(self, query: str, k: int = 5) -> List[Document]:
+        return self._get_store().similarity_search(query, k=k)
+
+    @_cache_results
+    def query_euclidean(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        snapshot = self._ensure_matrix()
+        if len(snapshot.matrix) == 0:
+            return []
+
+        # Embed query
+        query_emb = np.asarray(self.embedding_model.embed_query(query), dtype=np.float32)
+
+        # ||e - q||^2 = ||e||^2 - 2 e.q + ||q||^2, without materializing the (N, D) difference
+        sq_distances = snapshot.sq_norms - 2.0 * snapshot.dot_all(query_emb) + query_emb @ query_emb
+        distances = np.sqrt(np.maximum(sq_distances, 0.0))
+        scores = self._get_store()._euclidean_relevance_score_fn(distances)
+
+        # Highest scores first (higher = more relevant); only the winners become Documents
+        return [(snapshot.document(i), float(scores[i])) for i in _top_k_indices(scores, k)]
+
+
+    @_cache_results
+    def query_mmr(self, query: str, k: int = 5, fetch_k: int = 20, lambda_mult: float = 0.5) -> List[Document]:
+        snapshot = self._ensure_matrix()
+        if len(snapshot.matrix) == 0:
+            return []
 
+        query_emb = np.asarray(self.embedding_model.embed_query(query), dtype=np.float32)
+        query_emb /= np.linalg.norm(query_emb)
 
-    def query_mmr(self, query: str, k: int = 5) -> List[Document]:
-        vectorstore = Chroma(persist_directory=self.persist_dir, embedding_function=self.embedding_model)
-        return vectorstore.max_marginal_relevance_search(query, k=k, fetch_k=20)
+        # Most similar fetch_k candidates by cosine, then diversify among them
+        norms = np.sqrt(snapshot.sq_norms)
+        candidate_idx = _top_k_indices(snapshot.dot_all(query_emb) / norms, fetch_k)
+        candidates = snapshot.rows(candidate_idx) / norms[candidate_idx, None]
 
+        return [
+            snapshot.document(i)
+            for i in candidate_idx[_maximal_marginal_relevance(query_emb, candidates, k, lambda_mult)]
+        ]
+
+    @_cache_results
     def query_hybrid(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
         # Placeholder: hybrid = 0.6 * cosine + 0.4 * legal entity match
         # We'll simulate "legal entity match" as keyword match for now
-        vectorstore = Chroma(persist_directory=self.persist_dir, embedding_function=self.embedding_model)
-        cosine_results = vectorstore.similarity_search_with_relevance_scores(query, k=k*2)
+        cosine_results = self._get_store().similarity_search_with_relevance_scores(query, k=k*2)
         final = []
         for doc, score in cosine_results:
             # Simulate legal keyword match score
-            legal_keywords = ["section", "act", "court", "gst", "income", "registration"]
-            match_score = sum(1 for word in legal_keywords if word in doc.page_content.lower())
+            match_score = _legal_keyword_score(doc.page_content)
             hybrid_score = 0.6 * score + 0.4 * match_score
             final.append((doc, hybrid_score))
         final.sort(key=lambda x: x[1], reverse=True)
         return final[:k]
 
-    def reset(self):
-        if os.path.exists(self.persist_dir):
-            import shutil
-            shutil.rmtree(self.persist_dir)
-        self.documents = []
-        self.vectorstore = None
+    def query_all(self, query: str, k: int = 5) -> Dict[str, list]:
+        # Embed the query and load the search matrix up front so the workers share them
+        # instead of racing to compute them
+        self.embedding_model.embed_query(query)
+        self._ensure_matrix()
 
-    def evaluate(self, query: str, ground_truth_sources: List[str], k=5) -> Dict[str, Dict[str, float]]:
         methods = {
             "cosine": self.query_cosine,
-            "euclidean": lambda q, k: [doc for doc, _ in self.query_euclidean(q, k)],
+            "euclidean": self.query_euclidean,
             "mmr": self.query_mmr,
-            "hybrid": lambda q, k: [doc for doc, _ in self.query_hybrid(q, k)],
+            "hybrid": self.query_hybrid,
+        }
+        # The methods are independent and spend their time in Chroma or NumPy, which release the GIL
+        with ThreadPoolExecutor(max_workers=len(methods)) as executor:
+            futures = {name: executor.submit(method, query, k) for name, method in methods.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def reset(self):
+        with self._index_lock:
+            # Drop the collection through the open client; deleting its files underneath
+            # a live handle would leave it pointing at a removed database
+            if self.vectorstore is not None:
+                self.vectorstore.delete_collection()
+                if os.path.exists(self._manifest_path()):
+                    os.remove(self._manifest_path())
+            elif os.path.exists(self.persist_dir):
+                import shutil
+                shutil.rmtree(self.persist_dir)
+            self.documents = []
+            self.vectorstore = None
+            self._invalidate_caches()
+
+    def evaluate(self, query: str, ground_truth_sources: List[str], k=5,
+                 results: Optional[Dict[str, list]] = None) -> Dict[str, Dict[str, float]]:
+        # Callers that already ran query_all(query, k) can pass its output to skip the searches
+        if results is None:
+            results = self.query_all(query, k)
+        # Euclidean and hybrid results come with scores
+        results = {
+            method_name: [doc for doc, _ in top] if method_name in ("euclidean", "hybrid") else top
+            for method_name, top in results.items()
         }
 
+        # Hash-based membership instead of scanning the ground-truth list per result
+        relevant_sources = frozenset(ground_truth_sources)
         scores = defaultdict(dict)
 
-        for method_name, method_func in methods.items():
-            top_docs = method_func(query, k)
+        for method_name, top_docs in results.items():
             sources = [doc.metadata['source'] for doc in top_docs]
 
             # Precision@k
-            true_positive = sum(1 for s in sources if s in ground_truth_sources)
+            true_positive = sum(1 for s in sources if s in relevant_sources)
             precision = true_positive / k
 
             # Recall (simple version: overlap with ground truth set)